@@ -3,6 +3,8 @@ Handle multiple parsed junit reports
 """
 from __future__ import unicode_literals
 import os
+import multiprocessing
+from collections import Counter, defaultdict
 from junit2htmlreport import parser
 from junit2htmlreport.parser import SKIPPED, FAILED, PASSED, ABSENT
 
@@ -11,6 +13,55 @@ PARTIAL_PASS = "partial pass"
 PARTIAL_FAIL = "partial failure"
 TOTAL_FAIL = "total failure"
 
+SHORT_OUTCOMES = {
+    PASSED: "/",
+    SKIPPED: "s",
+    FAILED: "f",
+    TOTAL_FAIL: "F",
+    PARTIAL_PASS: "%",
+    PARTIAL_FAIL: "X",
+    UNTESTED: "U",
+}
+
+HTML_SHORT_OUTCOMES = dict(SHORT_OUTCOMES)
+HTML_SHORT_OUTCOMES[PASSED] = "ok"
+
+OUTCOME_TITLES = dict((outcome, outcome.title()) for outcome in [
+    PASSED, SKIPPED, FAILED, ABSENT,
+    TOTAL_FAIL, PARTIAL_PASS, PARTIAL_FAIL, UNTESTED])
+
+# bits used to record which outcomes appear in a row of the matrix
+OUTCOME_BITS = {
+    PASSED: 1,
+    FAILED: 2,
+    SKIPPED: 4,
+}
+
+# html matrix templates
+STATS_ROW = "<tr><th class='%s'>%s<th><td align='right'>%d</td></tr>"
+STATS_CELL = "<td rowspan='%d'>%s</td>"
+UNDERSKIP_CELL = "<td align='middle'>&#124;</td>"
+HEADER_ROW = "<tr>%s%s<td colspan='%d'><pre>%s</pre></td></tr>"
+CLASS_ROW = "<tr class='testclass'><td colspan='%d'>%s</td></tr>\n"
+CASE_ROW = "<tr class='testcase'><td width='16'>-&nbsp;%s</td>"
+CASE_CELL = "<td class='testcase-cell %s'>" \
+            "<a class='tooltip-parent testcase-link' href='%s.html#%s'>%s" \
+            "<div class='tooltip'>(%s) %s</div></a></td>"
+ABSENT_CELL = "<td class='testcase-cell %s'></td>" % ABSENT
+COMBINED_CELL = "<td span class='testcase-combined'>%s</td></tr>"
+
+
+def parse_report(filename):
+    """
+    Parse a report file, for use in a worker process
+    :param filename:
+    :return:
+    """
+    parsed = parser.Junit(filename=filename)
+    # the xml tree is no longer needed and is costly to send back
+    parsed.tree = None
+    return parsed
+
 
 class ReportMatrix(object):
     """
@@ -19,31 +70,29 @@ class ReportMatrix(object):
 
     def __init__(self):
         self.reports = {}
-        self.cases = {}
-        self.classes = {}
-        self.casenames = {}
-        self.result_stats = {}
+        self.cases = defaultdict(lambda: defaultdict(dict))
+        self.classes = defaultdict(dict)
+        self.casenames = defaultdict(set)
+        self.result_stats = Counter()
+        self._report_order = None
+        self._case_order = {}
+        self._combined_results = {}
+        self._name_width = 0
 
     def report_order(self):
-        return sorted(self.reports.keys())
+        if self._report_order is None:
+            self._report_order = tuple(sorted(self.reports))
+        return self._report_order
+
+    def case_order(self, classname):
+        if classname not in self._case_order:
+            self._case_order[classname] = tuple(sorted(self.casenames[classname]))
+        return self._case_order[classname]
+
+    short_outcomes = SHORT_OUTCOMES
 
     def short_outcome(self, outcome):
-        if outcome == PASSED:
-            return "/"
-        elif outcome == SKIPPED:
-            return "s"
-        elif outcome == FAILED:
-            return "f"
-        elif outcome == TOTAL_FAIL:
-            return "F"
-        elif outcome == PARTIAL_PASS:
-            return "%"
-        elif outcome == PARTIAL_FAIL:
-            return "X"
-        elif outcome == UNTESTED:
-            return "U"
-
-        return "?"
+        return self.short_outcomes.get(outcome, "?")
 
     def add_report(self, filename):
         """
@@ -51,32 +100,71 @@ class ReportMatrix(object):
         :param filename:
         :return:
         """
-        parsed = parser.Junit(filename=filename)
+        self.add_parsed_report(filename, parser.Junit(filename=filename))
+
+    def add_reports(self, filenames, processes=None, context=None):
+        """
+        Load several reports into the matrix, parsing them in parallel
+
+        Parsed reports are pickled back to this process one at a time, which
+        for large reports costs more than parsing them, so this is only a win
+        when parsing dominates. The command line tool loads files serially.
+        :param filenames:
+        :param processes: number of worker processes, default is one per
+                          file up to the number of cpus
+        :param context: multiprocessing context to create the pool from
+        :return:
+        """
+        filenames = list(filenames)
+        if len(filenames) < 2:
+            for filename in filenames:
+                self.add_report(filename)
+            return
+
+        if context is None:
+            context = multiprocessing
+        if processes is None:
+            processes = min(len(filenames), context.cpu_count())
+        pool = context.Pool(processes)
+        try:
+            reports = pool.map(parse_report, filenames)
+            pool.close()
+        except BaseException:
+            # eg, ctrl-c kills the workers, their tasks will never finish
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+        for filename, parsed in zip(filenames, reports):
+            self.add_parsed_report(filename, parsed)
+
+    def add_parsed_report(self, filename, parsed):
+        """
+        Add an already parsed report to the matrix
+        :param filename:
+        :param parsed:
+        :return:
+        """
         filename = os.path.basename(filename)
         self.reports[filename] = parsed
+        self._report_order = None
+        self._case_order.clear()
 
         for suite in parsed.suites:
             for testclass in suite.classes:
-                if testclass not in self.classes:
-                    self.classes[testclass] = {}
-                if testclass not in self.casenames:
-                    self.casenames[testclass] = list()
                 self.classes[testclass][filename] = suite.classes[testclass]
+                self._name_width = max(len(testclass), self._name_width)
 
                 for testcase in self.classes[testclass][filename].cases:
                     basename = testcase.basename().strip()
-                    if basename not in self.casenames:
-                        self.casenames[testclass].append(basename)
-
-                    if testclass not in self.cases:
-                        self.cases[testclass] = {}
-                    if basename not in self.cases[testclass]:
-                        self.cases[testclass][basename] = {}
+                    if basename not in self.casenames[testclass]:
+                        self.casenames[testclass].add(basename)
+                        self._name_width = max(len(basename),
+                                               self._name_width)
                     self.cases[testclass][basename][filename] = testcase
 
-                    outcome = testcase.outcome()
-                    self.result_stats[outcome] = 1 + self.result_stats.get(
-                        outcome, 0)
+                    self.result_stats[testcase.outcome()] += 1
 
     def summary(self):
         """
@@ -91,17 +179,41 @@ class ReportMatrix(object):
         :param results:
         :return:
         """
-        if PASSED in results:
-            if FAILED in results:
-                return self.short_outcome(PARTIAL_FAIL), PARTIAL_FAIL.title()
-            if SKIPPED in results:
-                return self.short_outcome(PARTIAL_PASS), PARTIAL_PASS.title()
-            return self.short_outcome(PASSED), PASSED.title()
-
-        if FAILED in results:
-            return self.short_outcome(TOTAL_FAIL), TOTAL_FAIL.title()
-        if SKIPPED in results:
-            return self.short_outcome(UNTESTED), UNTESTED.title()
+        mask = 0
+        for outcome in results:
+            mask |= OUTCOME_BITS.get(outcome, 0)
+        return self.combined_mask_result(mask)
+
+    def combined_mask_result(self, mask):
+        """
+        Produce the combined result for a mask of OUTCOME_BITS
+        :param mask:
+        :return:
+        """
+        if mask not in self._combined_results:
+            self._combined_results[mask] = self._combine(mask)
+        return self._combined_results[mask]
+
+    def _combine(self, mask):
+        """
+        Produce the combined result for the given mix of outcomes
+        :param mask:
+        :return:
+        """
+        passed = mask & OUTCOME_BITS[PASSED]
+        failed = mask & OUTCOME_BITS[FAILED]
+        skipped = mask & OUTCOME_BITS[SKIPPED]
+        if passed:
+            if failed:
+                return self.short_outcome(PARTIAL_FAIL), OUTCOME_TITLES[PARTIAL_FAIL]
+            if skipped:
+                return self.short_outcome(PARTIAL_PASS), OUTCOME_TITLES[PARTIAL_PASS]
+            return self.short_outcome(PASSED), OUTCOME_TITLES[PASSED]
+
+        if failed:
+            return self.short_outcome(TOTAL_FAIL), OUTCOME_TITLES[TOTAL_FAIL]
+        if skipped:
+            return self.short_outcome(UNTESTED), OUTCOME_TITLES[UNTESTED]
         return " ", ""
 
 
@@ -114,11 +226,11 @@ class HtmlReportMatrix(ReportMatrix, parser.HtmlHeadMixin):
         super(HtmlReportMatrix, self).__init__()
         self.outdir = outdir
 
-    def add_report(self, filename):
+    def add_parsed_report(self, filename, parsed):
         """
-        Load a report
+        Add a report and write its own html page
         """
-        super(HtmlReportMatrix, self).add_report(filename)
+        super(HtmlReportMatrix, self).add_parsed_report(filename, parsed)
         basename = os.path.basename(filename)
         # make the individual report too
         report = self.reports[basename].html()
@@ -127,30 +239,40 @@ class HtmlReportMatrix(ReportMatrix, parser.HtmlHeadMixin):
             filehandle.write(report)
 
     def get_stats_table(self):
-        stats = "<table class='result-stats'>"
+        stats = ["<table class='result-stats'>"]
         for outcome in sorted(self.result_stats.keys()):
-            stats += "<tr><th class='{}'>{}<th>" \
-                     "<td align='right'>{}</td></tr>".format(
-                outcome,
-                outcome.title(),
-                self.result_stats[outcome]
-            )
-        stats += "</table>"
-        return stats
+            stats.append(STATS_ROW % (outcome,
+                                      outcome.title(),
+                                      self.result_stats[outcome]))
+        stats.append("</table>")
+        return "".join(stats)
 
-    def short_outcome(self, outcome):
-        if outcome == PASSED:
-            return "ok"
-        return super(HtmlReportMatrix, self).short_outcome(outcome)
+    short_outcomes = HTML_SHORT_OUTCOMES
 
     def summary(self):
         """
         Render the html
         :return:
         """
-        output = self.get_html_head("")
-        output += "<body>"
-        output += "<h2>Reports Matrix</h2><hr size='1'/>"
+        return "".join(self._iter_summary())
+
+    def write_summary(self, fileobj):
+        """
+        Render the html directly to an open file
+        :param fileobj:
+        :return:
+        """
+        for chunk in self._iter_summary():
+            fileobj.write(chunk)
+
+    def _iter_summary(self):
+        """
+        Render the html as a sequence of fragments
+        :return:
+        """
+        yield self.get_html_head("")
+        yield "<body>"
+        yield "<h2>Reports Matrix</h2><hr size='1'/>"
 
         # table headers,
         #
@@ -161,96 +283,68 @@ class HtmlReportMatrix(ReportMatrix, parser.HtmlHeadMixin):
         #   test1  f  /  s  % Partial Failure
         #   test2  s  /  -  % Partial Pass
         #   test3  /  /  /  * Pass
-        output += "<table class='test-matrix'>"
-
-        def make_underskip(length):
-            return "<td align='middle'>&#124;</td>" * length
-
-        spansize = 1 + len(self.reports)
+        yield "<table class='test-matrix'>"
+
+        axes = self.report_order()
+        short = self.short_outcome
+        titles = OUTCOME_TITLES
+        bits = OUTCOME_BITS
+        report_count = len(axes)
+        spansize = 1 + report_count
         report_headers = 0
 
-        shown_stats = False
+        # the stats table sits to the left of the first header row
+        first_cell = STATS_CELL % (report_count, self.get_stats_table())
 
-        stats = self.get_stats_table()
-
-        for axis in self.report_order():
+        for axis in axes:
             label = axis
             if label.endswith(".xml"):
                 label = label[:-4]
-            underskip = make_underskip(report_headers)
+            underskip = UNDERSKIP_CELL * report_headers
 
-            header = "<td colspan='{}'><pre>{}</pre></td>".format(spansize,
-                                                                  label)
+            yield HEADER_ROW % (first_cell, underskip, spansize, label)
             spansize -= 1
             report_headers += 1
             first_cell = ""
-            if not shown_stats:
-                # insert the stats table
-                first_cell = "<td rowspan='{}'>{}</td>".format(
-                    len(self.report_order()),
-                    stats
-                )
-                shown_stats = True
-
-            output += "<tr>{}{}{}</tr>".format(first_cell,
-                                               underskip, header)
 
-        output += "<tr><td></td>{}</tr>".format(
-            make_underskip(len(self.reports)))
+        yield "<tr><td></td>%s</tr>" % (UNDERSKIP_CELL * report_count)
 
         # iterate each class
+        class_colspan = report_count + 2
         for classname in self.classes:
             # new class
-            output += "<tr class='testclass'><td colspan='{}'>{}</td></tr>\n".format(
-                len(self.reports) + 2,
-                classname)
+            yield CLASS_ROW % (class_colspan, classname)
 
             # print the case name
-            for casename in sorted(set(self.casenames[classname])):
-                output += "<tr class='testcase'><td width='16'>-&nbsp;{}</td>".format(casename)
+            for casename in self.case_order(classname):
+                row = [CASE_ROW % casename]
 
-                case_results = []
+                row_mask = 0
+                case_reports = self.cases[classname][casename]
 
                 # print each test and its result for each axis
-                celltds = ""
-                for axis in self.report_order():
-                    cellclass = ABSENT
-                    anchor = None
-                    if axis not in self.cases[classname][casename]:
-                        cell = "&nbsp;"
-                    else:
-                        testcase = self.cases[classname][casename][axis]
-                        anchor = testcase.anchor()
-
-                        cellclass = testcase.outcome()
-                        cell = self.short_outcome(cellclass)
-                    case_results.append(cellclass)
+                for axis in axes:
+                    if axis not in case_reports:
+                        row.append(ABSENT_CELL)
+                        continue
 
-                    cell = "<a class='tooltip-parent testcase-link' href='{}.html#{}'>{}{}</a>".format(
-                        axis, anchor, cell,
-                        "<div class='tooltip'>({}) {}</div>".format(
-                            cellclass.title(),
-                            axis)
-                    )
-                    if cellclass == ABSENT:
-                        cell = ""
+                    testcase = case_reports[axis]
+                    cellclass = testcase.outcome()
+                    row_mask |= bits.get(cellclass, 0)
 
-                    celltds += "<td class='testcase-cell {}'>{}</td>".format(
-                        cellclass,
-                        cell)
+                    row.append(CASE_CELL % (cellclass,
+                                            axis, testcase.anchor(),
+                                            short(cellclass),
+                                            titles[cellclass], axis))
 
-                combined_name = self.combined_result(case_results)[1]
+                combined_name = self.combined_mask_result(row_mask)[1]
 
-                output += celltds
-                output += "<td span class='testcase-combined'>{}</td>".format(
-                    combined_name
-                )
-                output += "</tr>"
+                row.append(COMBINED_CELL % combined_name)
+                yield "".join(row)
 
-        output += "</table>"
-        output += "</body>"
-        output += "</html>"
-        return output
+        yield "</table>"
+        yield "</body>"
+        yield "</html>"
 
 
 class TextReportMatrix(ReportMatrix):
@@ -264,71 +358,64 @@ class TextReportMatrix(ReportMatrix):
         :return:
         """
 
-        output = "\nMatrix Test Report\n"
-        output += "===================\n"
+        parts = ["\nMatrix Test Report\n",
+                 "===================\n"]
 
-        axis = list(self.reports.keys())
-        axis.sort()
+        axes = self.report_order()
+        short = self.short_outcome
+        bits = OUTCOME_BITS
 
-        # find the longest classname or test case name
-        left_indent = 0
-        for classname in self.classes:
-            left_indent = max(len(classname), left_indent)
-            for casename in self.casenames[classname]:
-                left_indent = max(len(casename), left_indent)
+        # the longest classname or test case name
+        left_indent = self._name_width
 
         # render the axis headings in a stepped tree
-        treelines = ""
-        for filename in self.report_order():
-            output += "{}    {}{}\n".format(" " * left_indent, treelines,
-                                            filename)
-            treelines += "| "
-        output += "{}    {}\n".format(" " * left_indent, treelines)
+        treelines = []
+        for filename in axes:
+            parts.append("{}    {}{}\n".format(" " * left_indent,
+                                                "".join(treelines),
+                                                filename))
+            treelines.append("| ")
+        parts.append("{}    {}\n".format(" " * left_indent,
+                                          "".join(treelines)))
         # render in groups of the same class
 
         for classname in self.classes:
             # new class
-            output += "{}  \n".format(classname)
+            parts.append("{}  \n".format(classname))
 
             # print the case name
-            for casename in sorted(set(self.casenames[classname])):
-                output += "- {}{}  ".format(casename,
-                                            " " * (left_indent - len(casename)))
+            for casename in self.case_order(classname):
+                parts.append("- {}{}  ".format(
+                    casename, " " * (left_indent - len(casename))))
 
                 # print each test and its result for each axis
-                case_data = ""
-                case_results = []
-                for axis in self.report_order():
-                    if axis not in self.cases[classname][casename]:
-                        case_data += "  "
+                case_data = []
+                row_mask = 0
+                case_reports = self.cases[classname][casename]
+                for axis in axes:
+                    if axis not in case_reports:
+                        case_data.append("  ")
                     else:
-                        testcase = self.cases[classname][casename][axis]
-                        if testcase.skipped:
-                            case_data += "s "
-                            case_results.append(SKIPPED)
-                        elif testcase.failure:
-                            case_data += "f "
-                            case_results.append(FAILED)
-                        else:
-                            case_data += "/ "
-                            self.append = case_results.append(PASSED)
-
-                combined, combined_name = self.combined_result(case_results)
-
-                output += case_data
-                output += " {} {}\n".format(combined, combined_name)
+                        outcome = case_reports[axis].outcome()
+                        case_data.append(short(outcome) + " ")
+                        row_mask |= bits.get(outcome, 0)
+
+                combined, combined_name = self.combined_mask_result(row_mask)
+
+                parts.extend(case_data)
+                parts.append(" {} {}\n".format(combined, combined_name))
 
         # print the result stats
 
-        output += "\n"
-        output += "-" * 79
-        output += "\n"
+        parts.append("\n")
+        parts.append("-" * 79)
+        parts.append("\n")
 
-        output += "Test Results:\n"
+        parts.append("Test Results:\n")
 
         for outcome in sorted(self.result_stats):
-            output += "  {:<12} : {:>6}\n".format(
+            parts.append("  {:<12} : {:>6}\n".format(
                 outcome.title(),
-                self.result_stats[outcome])
+                self.result_stats[outcome]))
 
-        return output
+        return "".join(parts)
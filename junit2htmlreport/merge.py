@@ -6,7 +6,11 @@ import os
 from io import BytesIO
 from junit2htmlreport import parser
 from junit2htmlreport.textutils import unicode_str
-import xml.etree.ElementTree as ET
+try:
+    # the C implementation, python 3 uses this by default
+    import xml.etree.cElementTree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
 
 
 def has_xml_header(filepath):
@@ -2,7 +2,11 @@
 Parse a junit report file into a family of objects
 """
 from __future__ import unicode_literals
-import xml.etree.ElementTree as ET
+try:
+    # the C implementation, python 3 uses this by default
+    import xml.etree.cElementTree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
 import collections
 from junit2htmlreport import tag
 from junit2htmlreport.textutils import unicode_str
@@ -51,7 +51,7 @@ def run(args):
         for filename in args:
             hmatrix.add_report(filename)
         with open(opts.html_matrix, "w") as outfile:
-            outfile.write(hmatrix.summary())
+            hmatrix.write_summary(outfile)
     else:
         outfilename = args[0] + ".html"
         if len(args) > 1:
@@ -1,11 +1,21 @@
 """
 Test the matrix functionality
 """
+import multiprocessing
+import os
+import re
+import pytest
 from inputfiles import get_filepath
 from junit2htmlreport import matrix
 from junit2htmlreport.matrix import PARTIAL_PASS, PARTIAL_FAIL, TOTAL_FAIL, UNTESTED
 from junit2htmlreport.parser import PASSED, SKIPPED, FAILED
 
+AXIS_REPORTS = ["junit-axis-linux.xml",
+                "junit-axis-solaris.xml",
+                "junit-axis-windows.xml"]
+
+ANCHOR_LINK = re.compile(r"href='([^']+)\.html#([^']+)'")
+
 
 def test_combined_result():
     """
@@ -55,6 +65,105 @@ def test_matrix_load(tmpdir):
     print(result)
 
 
+def test_matrix_casenames():
+    """
+    Test that case names seen in several reports are only recorded once
+    :return:
+    """
+    textmatrix = matrix.TextReportMatrix()
+    textmatrix.add_report(get_filepath("junit-axis-linux.xml"))
+    textmatrix.add_report(get_filepath("junit-axis-solaris.xml"))
+    textmatrix.add_report(get_filepath("junit-axis-windows.xml"))
+
+    for classname in textmatrix.classes:
+        casenames = textmatrix.casenames[classname]
+        assert len(casenames) == len(textmatrix.cases[classname])
+
+
+def test_matrix_add_reports():
+    """
+    Test loading several reports in parallel gives the same matrix
+    :return:
+    """
+    filenames = [get_filepath(x) for x in AXIS_REPORTS]
+    serial = matrix.TextReportMatrix()
+    for filename in filenames:
+        serial.add_report(filename)
+
+    parallel = matrix.TextReportMatrix()
+    parallel.add_reports(filenames, processes=2)
+
+    assert parallel.report_order() == serial.report_order()
+    assert parallel.casenames == serial.casenames
+    assert parallel.result_stats == serial.result_stats
+    assert parallel.summary() == serial.summary()
+
+
+@pytest.mark.skipif(not hasattr(multiprocessing, "get_context"),
+                    reason="multiprocessing contexts need python 3.4")
+def test_matrix_add_reports_spawn():
+    """
+    Test parallel loading when worker processes are spawned
+    :return:
+    """
+    filenames = [get_filepath(x) for x in AXIS_REPORTS]
+    serial = matrix.TextReportMatrix()
+    for filename in filenames:
+        serial.add_report(filename)
+
+    parallel = matrix.TextReportMatrix()
+    parallel.add_reports(filenames, processes=2,
+                         context=multiprocessing.get_context("spawn"))
+
+    assert parallel.summary() == serial.summary()
+
+
+def test_matrix_add_reports_error():
+    """
+    Test a report failing to load in a worker is raised by add_reports
+    :return:
+    """
+    filenames = [get_filepath("junit-axis-linux.xml"),
+                 get_filepath("no-such-report.xml")]
+    textmatrix = matrix.TextReportMatrix()
+    with pytest.raises(IOError):
+        textmatrix.add_reports(filenames, processes=2)
+
+
+def test_matrix_html_add_reports(tmpdir):
+    """
+    Test parallel loading writes each report page and the same html matrix
+    :return:
+    """
+    filenames = [get_filepath(x) for x in AXIS_REPORTS]
+    serialdir = tmpdir.mkdir("serial")
+    paralleldir = tmpdir.mkdir("parallel")
+
+    serial = matrix.HtmlReportMatrix(str(serialdir))
+    for filename in filenames:
+        serial.add_report(filename)
+
+    parallel = matrix.HtmlReportMatrix(str(paralleldir))
+    parallel.add_reports(filenames, processes=2)
+
+    pages = {}
+    for name in AXIS_REPORTS:
+        page = paralleldir.join(name + ".html")
+        assert page.check(file=1)
+        pages[name] = page.read()
+
+    result = parallel.summary()
+
+    # anchors are random, so compare with them blanked out
+    assert ANCHOR_LINK.sub("", result) == ANCHOR_LINK.sub("", serial.summary())
+
+    # every cell must link to an anchor in that report's own page
+    links = ANCHOR_LINK.findall(result)
+    assert links
+    for report, anchor in links:
+        assert "name=\"{}\"".format(anchor) in pages[report]
+
+
 def test_matrix_html(tmpdir):
     """
     Test loading multiple reports
@@ -69,3 +178,19 @@ def test_matrix_html(tmpdir):
     result = htmatrix.summary()
 
     assert result.endswith("</html>")
+
+
+def test_matrix_html_write(tmpdir):
+    """
+    Test writing the matrix html straight to a file
+    :return:
+    """
+    htmatrix = matrix.HtmlReportMatrix(str(tmpdir))
+    htmatrix.add_report(get_filepath("junit-axis-linux.xml"))
+    htmatrix.add_report(get_filepath("junit-axis-windows.xml"))
+
+    outfile = tmpdir.join("matrix.html")
+    with open(str(outfile), "w") as filehandle:
+        htmatrix.write_summary(filehandle)
+
+    assert outfile.read() == htmatrix.summary()